@@ -1,10 +1,11 @@
-from typing import Optional, List
-from app.models import Driver, Ride, GlobalState, DriverStatus
+from typing import Optional
+from app.models import Ride, GlobalState
+from app.spatial import GRID_MAX, cell_of, ring_min_distance
 
 
-def manhattan_distance(a: dict, b: dict) -> int:
+def manhattan_distance(ax: int, ay: int, bx: int, by: int) -> int:
     """Calculate Manhattan distance between two points."""
-    return abs(a['x'] - b['x']) + abs(a['y'] - b['y'])
+    return abs(ax - bx) + abs(ay - by)
 
 
 class Dispatcher:
@@ -18,27 +19,48 @@ class Dispatcher:
         
         Returns driver_id or None if no available drivers.
         """
-        available_drivers = [
-            driver for driver in state.drivers.values()
-            if driver.status == DriverStatus.available 
-            and driver.id not in ride.rejected_driver_ids
-        ]
-        
-        if not available_drivers:
+        index = state.available_drivers
+        if not len(index):
             return None
         
-        def driver_sort_key(driver: Driver):
-            # Calculate ETA to pickup
-            eta = manhattan_distance(
-                {'x': driver.x, 'y': driver.y},
-                {'x': ride.pickup.x, 'y': ride.pickup.y}
-            )
-            
-            # Calculate idle ticks (negative for descending sort)
-            idle_ticks = state.tick - (driver.last_busy_tick if driver.last_busy_tick is not None else -999999)
+        px, py = ride.pickup.x, ride.pickup.y
+        # Rejections stay an ordered list on the ride (it is the history shown
+        # to clients); probe a set built once per call instead of scanning it.
+        rejected = set(ride.rejected_driver_ids)
+        
+        # Visit rings of grid buckets outward from the pickup's bucket. Ring r
+        # cannot hold anything closer than ring_min_distance(r), so once that
+        # bound exceeds the best ETA found, no further driver can win or tie
+        # and the fairness tie-breakers have seen the same candidates as a
+        # full scan would.
+        cx, cy = cell_of(px, py)
+        last_cx, last_cy = cell_of(GRID_MAX, GRID_MAX)
+        max_ring = max(cx, cy, last_cx - cx, last_cy - cy)
+        best_id = None
+        best_eta = best_assigned = best_last_busy = 0
+        for r in range(max_ring + 1):
+            if best_id is not None and ring_min_distance(r) > best_eta:
+                break
             
-            # Return tuple for lexicographic sorting
-            return (eta, driver.assigned_count, -idle_ticks)
+            for driver_id, (x, y, (assigned, last_busy)) in index.ring(cx, cy, r):
+                if driver_id in rejected:
+                    continue
+                
+                eta = abs(x - px) + abs(y - py)  # manhattan_distance, inlined
+                if best_id is not None and eta > best_eta:
+                    continue
+                
+                # Running lexicographic minimum over (eta, assigned_count, last_busy),
+                # with the fairness fields read from the index entry. Longest idle
+                # first is smallest last_busy_tick first, since the tick is fixed
+                # for the whole call.
+                if (best_id is None
+                        or eta < best_eta
+                        or (assigned < best_assigned
+                            or (assigned == best_assigned and last_busy < best_last_busy))):
+                    best_id = driver_id
+                    best_eta = eta
+                    best_assigned = assigned
+                    best_last_busy = last_busy
         
-        best_driver = min(available_drivers, key=driver_sort_key)
-        return best_driver.id
\ No newline at end of file
+        return best_id
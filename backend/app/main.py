@@ -1,13 +1,13 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict, Any
-import uuid
+from typing import Dict, List, Union
 
 from app.models import (
-    Driver, Rider, Ride, GlobalState, DriverStatus, RideStatus,
-    CreateDriverRequest, CreateRiderRequest, RequestRideRequest, Position
+    Driver, Rider, Ride, GlobalState, StateSnapshot, TickResult, AdvanceUntilResult,
+    DriverStatus, RideStatus, CreateDriverRequest, CreateRiderRequest, RequestRideRequest,
+    BulkCreateDriversRequest, BulkCreateRidersRequest, AdvanceUntilRequest, Position
 )
-from app.dispatcher import Dispatcher, manhattan_distance
+from app.dispatcher import Dispatcher
 
 app = FastAPI(title="Ride Hailing Simulation API")
 
@@ -19,37 +19,72 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global state
+# Global state. Every endpoint is `async def` and never awaits, so each
+# request runs to completion on the event loop thread before the next one
+# starts; plain `def` endpoints would run concurrently in the threadpool and
+# interleave their mutations. State is per process: run a single worker.
 state = GlobalState()
 dispatcher = Dispatcher()
 
+# Ride statuses that still hold a rider (and possibly a driver). A frozenset
+# built once makes the membership test a single hash probe instead of four
+# enum attribute lookups and comparisons per ride.
+UNFINISHED_RIDE_STATUSES = frozenset({
+    RideStatus.waiting, RideStatus.assigned, RideStatus.awaiting_accept, RideStatus.in_progress,
+})
 
-@app.get("/state", response_model=Dict[str, Any])
-def get_state():
+
+def snapshot_response() -> Response:
+    """
+    Return the state snapshot as pre-encoded JSON.
+    
+    Returning the models through `response_model` makes FastAPI dump every
+    entity to a dict, validate those dicts against the response model and
+    then JSON-encode them; GlobalState.snapshot_json skips all of that.
+    """
+    return Response(content=state.snapshot_json(), media_type="application/json")
+
+
+@app.get("/state", response_model=StateSnapshot)
+async def get_state():
     """Get the entire state snapshot."""
-    return {
-        "tick": state.tick,
-        "drivers": list(state.drivers.values()),
-        "riders": list(state.riders.values()),
-        "rides": list(state.rides.values())
-    }
+    return snapshot_response()
 
 
 @app.post("/drivers", response_model=Dict[str, Driver])
-def create_driver(request: CreateDriverRequest):
+async def create_driver(request: CreateDriverRequest):
     """Create a new driver."""
-    driver_id = request.id or str(uuid.uuid4())
+    driver_id = request.id or state.new_id("d", state.drivers)
     
     if driver_id in state.drivers:
         raise HTTPException(status_code=400, detail="Driver ID already exists")
     
     driver = Driver(id=driver_id, x=request.x, y=request.y)
-    state.drivers[driver_id] = driver
+    state.add_driver(driver)
     return {"driver": driver}
 
 
+@app.post("/drivers/bulk", response_model=Dict[str, List[Driver]])
+async def create_drivers_bulk(request: BulkCreateDriversRequest):
+    """Create several drivers in one request; none are created if any id is taken."""
+    ids = [item.id for item in request.items if item.id]
+    explicit_ids = set(ids)
+    if len(explicit_ids) != len(ids) or any(driver_id in state.drivers for driver_id in ids):
+        raise HTTPException(status_code=400, detail="Driver ID already exists")
+    
+    # Generated ids must not collide with explicit ids later in the batch
+    taken = state.drivers.keys() | explicit_ids if explicit_ids else state.drivers
+    drivers = []
+    for item in request.items:
+        driver_id = item.id or state.new_id("d", taken)
+        driver = Driver(id=driver_id, x=item.x, y=item.y)
+        state.add_driver(driver)
+        drivers.append(driver)
+    return {"drivers": drivers}
+
+
 @app.delete("/drivers/{driver_id}")
-def delete_driver(driver_id: str):
+async def delete_driver(driver_id: str):
     """Delete a driver."""
     if driver_id not in state.drivers:
         raise HTTPException(status_code=404, detail="Driver not found")
@@ -59,52 +94,72 @@ def delete_driver(driver_id: str):
     # If driver is on a ride, mark ride as failed
     if driver.current_ride_id and driver.current_ride_id in state.rides:
         ride = state.rides[driver.current_ride_id]
-        ride.status = RideStatus.failed
+        state.set_ride_status(ride, RideStatus.failed)
         ride.driver_id = None
     
-    del state.drivers[driver_id]
+    state.remove_driver(driver_id)  # also marks the state as changed
     return {"message": "Driver deleted successfully"}
 
 
 @app.post("/riders", response_model=Dict[str, Rider])
-def create_rider(request: CreateRiderRequest):
+async def create_rider(request: CreateRiderRequest):
     """Create a new rider."""
-    rider_id = request.id or str(uuid.uuid4())
+    rider_id = request.id or state.new_id("r", state.riders)
     
     if rider_id in state.riders:
         raise HTTPException(status_code=400, detail="Rider ID already exists")
     
     rider = Rider(id=rider_id, x=request.x, y=request.y)
-    state.riders[rider_id] = rider
+    state.add_rider(rider)
     return {"rider": rider}
 
 
+@app.post("/riders/bulk", response_model=Dict[str, List[Rider]])
+async def create_riders_bulk(request: BulkCreateRidersRequest):
+    """Create several riders in one request; none are created if any id is taken."""
+    ids = [item.id for item in request.items if item.id]
+    explicit_ids = set(ids)
+    if len(explicit_ids) != len(ids) or any(rider_id in state.riders for rider_id in ids):
+        raise HTTPException(status_code=400, detail="Rider ID already exists")
+    
+    # Generated ids must not collide with explicit ids later in the batch
+    taken = state.riders.keys() | explicit_ids if explicit_ids else state.riders
+    riders = []
+    for item in request.items:
+        rider_id = item.id or state.new_id("r", taken)
+        rider = Rider(id=rider_id, x=item.x, y=item.y)
+        state.add_rider(rider)
+        riders.append(rider)
+    return {"riders": riders}
+
+
 @app.delete("/riders/{rider_id}")
-def delete_rider(rider_id: str):
+async def delete_rider(rider_id: str):
     """Delete a rider."""
     if rider_id not in state.riders:
         raise HTTPException(status_code=404, detail="Rider not found")
     
     # Mark any pending rides for this rider as failed
     for ride in state.rides.values():
-        if ride.rider_id == rider_id and ride.status in [RideStatus.waiting, RideStatus.assigned, RideStatus.awaiting_accept, RideStatus.in_progress]:
-            ride.status = RideStatus.failed
+        if ride.rider_id == rider_id and ride.status in UNFINISHED_RIDE_STATUSES:
+            state.set_ride_status(ride, RideStatus.failed)
             if ride.driver_id and ride.driver_id in state.drivers:
                 driver = state.drivers[ride.driver_id]
-                driver.status = DriverStatus.available
+                state.set_driver_status(driver, DriverStatus.available)
                 driver.current_ride_id = None
     
     del state.riders[rider_id]
+    state.mark_changed()
     return {"message": "Rider deleted successfully"}
 
 
 @app.post("/rides/request", response_model=Dict[str, Ride])
-def request_ride(request: RequestRideRequest):
+async def request_ride(request: RequestRideRequest):
     """Request a new ride."""
     if request.rider_id not in state.riders:
         raise HTTPException(status_code=404, detail="Rider not found")
     
-    ride_id = str(uuid.uuid4())
+    ride_id = state.new_id("t", state.rides)  # "t" for trip; the UI shows the first 8 characters of ids
     ride = Ride(
         id=ride_id,
         rider_id=request.rider_id,
@@ -112,24 +167,24 @@ def request_ride(request: RequestRideRequest):
         dropoff=request.dropoff
     )
     
-    state.rides[ride_id] = ride
+    state.add_ride(ride)
     
     # Try to dispatch immediately
     driver_id = dispatcher.select_best_driver(ride, state)
     if driver_id:
         ride.driver_id = driver_id
-        ride.status = RideStatus.awaiting_accept
+        state.set_ride_status(ride, RideStatus.awaiting_accept)
         driver = state.drivers[driver_id]
-        driver.status = DriverStatus.assigned
+        state.set_driver_status(driver, DriverStatus.assigned)
         driver.current_ride_id = ride_id
     else:
-        ride.status = RideStatus.failed
+        state.set_ride_status(ride, RideStatus.failed)
     
     return {"ride": ride}
 
 
 @app.post("/rides/{ride_id}/accept")
-def accept_ride(ride_id: str):
+async def accept_ride(ride_id: str):
     """Accept a ride."""
     if ride_id not in state.rides:
         raise HTTPException(status_code=404, detail="Ride not found")
@@ -145,15 +200,15 @@ def accept_ride(ride_id: str):
     driver = state.drivers[ride.driver_id]
     
     # Accept the ride
-    ride.status = RideStatus.in_progress
-    driver.status = DriverStatus.on_trip
+    state.set_ride_status(ride, RideStatus.in_progress)
+    state.set_driver_status(driver, DriverStatus.on_trip)
     driver.assigned_count += 1  # Increment on accept as per fairness spec
     
     return {"ride": ride}
 
 
 @app.post("/rides/{ride_id}/reject")
-def reject_ride(ride_id: str):
+async def reject_ride(ride_id: str):
     """Reject a ride."""
     if ride_id not in state.rides:
         raise HTTPException(status_code=404, detail="Ride not found")
@@ -170,74 +225,141 @@ def reject_ride(ride_id: str):
     
     # Reject the ride
     ride.rejected_driver_ids.append(ride.driver_id)
-    driver.status = DriverStatus.available
+    state.mark_changed()
+    state.set_driver_status(driver, DriverStatus.available)
     driver.current_ride_id = None
     
     # Try to find another driver
     new_driver_id = dispatcher.select_best_driver(ride, state)
     if new_driver_id:
         ride.driver_id = new_driver_id
-        ride.status = RideStatus.awaiting_accept
+        state.set_ride_status(ride, RideStatus.awaiting_accept)
         new_driver = state.drivers[new_driver_id]
-        new_driver.status = DriverStatus.assigned
+        state.set_driver_status(new_driver, DriverStatus.assigned)
         new_driver.current_ride_id = ride_id
     else:
-        ride.status = RideStatus.failed
+        state.set_ride_status(ride, RideStatus.failed)
         ride.driver_id = None
     
     return {"ride": ride}
 
 
-@app.post("/tick", response_model=Dict[str, Any])
-def tick():
-    """Advance simulation by one tick."""
+def advance_tick() -> List[str]:
+    """Advance the simulation by one tick and return the ids of rides it completed."""
     state.tick += 1
+    state.mark_changed()
     
-    # Move all on_trip drivers
-    for ride in state.rides.values():
-        if ride.status == RideStatus.in_progress and ride.driver_id:
-            driver = state.drivers.get(ride.driver_id)
-            if not driver or driver.status != DriverStatus.on_trip:
-                continue
+    # Move all on_trip drivers. Only in-progress rides are visited; per ride,
+    # positions are read into locals once and the target is the pickup/dropoff
+    # Position itself (no dict per ride). The index is copied because
+    # completed rides leave it during the loop.
+    drivers = state.drivers
+    rides = state.rides
+    on_trip = DriverStatus.on_trip
+    completed_ride_ids = []
+    for ride_id in list(state.active_ride_ids):
+        ride = rides[ride_id]
+        if not ride.driver_id:
+            continue
+        driver = drivers.get(ride.driver_id)
+        if not driver or driver.status != on_trip:
+            continue
+        
+        x, y = driver.x, driver.y
+        pickup, dropoff = ride.pickup, ride.dropoff
+        
+        # Check if driver reached pickup and should switch to dropoff
+        heading_to_dropoff = driver.is_heading_to_dropoff
+        if not heading_to_dropoff and x == pickup.x and y == pickup.y:
+            heading_to_dropoff = driver.is_heading_to_dropoff = True
+        
+        # Determine target based on phase
+        target = dropoff if heading_to_dropoff else pickup
+        
+        # Move one step toward target using Manhattan path (x first, then y),
+        # stepping by the sign of the remaining offset
+        dx = target.x - x
+        if dx:
+            x += (dx > 0) - (dx < 0)
+            driver.x = x
+        else:
+            dy = target.y - y
+            y += (dy > 0) - (dy < 0)
+            driver.y = y
+        
+        # Check if reached dropoff (ride complete)
+        if x == dropoff.x and y == dropoff.y:
+            state.set_ride_status(ride, RideStatus.completed)
+            completed_ride_ids.append(ride_id)
+            driver.current_ride_id = None
+            driver.is_heading_to_dropoff = False  # Reset for next ride
+            driver.last_busy_tick = state.tick  # Update on completion for fairness
+            # Last, so the availability index sees the updated fairness fields
+            state.set_driver_status(driver, DriverStatus.available)
             
-            # Check if driver reached pickup and should switch to dropoff
-            if not driver.is_heading_to_dropoff and driver.x == ride.pickup.x and driver.y == ride.pickup.y:
-                driver.is_heading_to_dropoff = True
-            
-            # Determine target based on phase
-            target = {'x': ride.dropoff.x, 'y': ride.dropoff.y} if driver.is_heading_to_dropoff else {'x': ride.pickup.x, 'y': ride.pickup.y}
-            
-            # Move one step toward target using Manhattan path
-            if driver.x != target['x']:
-                driver.x += 1 if driver.x < target['x'] else -1
-            elif driver.y != target['y']:
-                driver.y += 1 if driver.y < target['y'] else -1
-            
-            # Check if reached dropoff (ride complete)
-            if driver.x == ride.dropoff.x and driver.y == ride.dropoff.y:
-                ride.status = RideStatus.completed
-                driver.status = DriverStatus.available
-                driver.current_ride_id = None
-                driver.is_heading_to_dropoff = False  # Reset for next ride
-                driver.last_busy_tick = state.tick  # Update on completion for fairness
-                
-                # Move rider to dropoff location
-                if ride.rider_id in state.riders:
-                    rider = state.riders[ride.rider_id]
-                    rider.x = ride.dropoff.x
-                    rider.y = ride.dropoff.y
+            # Move rider to dropoff location
+            if ride.rider_id in state.riders:
+                rider = state.riders[ride.rider_id]
+                rider.x = dropoff.x
+                rider.y = dropoff.y
+    
+    return completed_ride_ids
+
+
+@app.post("/tick", response_model=Union[StateSnapshot, TickResult])
+async def tick(include_state: bool = True):
+    """
+    Advance simulation by one tick.
+    
+    Returns the full state snapshot by default. With `include_state=false`
+    only the new tick and the ids of rides completed on it are returned,
+    for callers that step the simulation without redrawing it.
+    """
+    completed_ride_ids = advance_tick()
+    if include_state:
+        return snapshot_response()
+    return TickResult(tick=state.tick, completed_ride_ids=completed_ride_ids)
+
+
+@app.post("/tick/advance_until", response_model=AdvanceUntilResult)
+async def advance_until(request: AdvanceUntilRequest):
+    """
+    Advance the simulation until none of the given rides is in progress,
+    or until `max_ticks` ticks have run.
+    
+    Runs the ticks in-process, so a caller waiting on rides makes one request
+    instead of one /tick round-trip (and snapshot) per tick.
+    """
+    rides = state.rides
+    for ride_id in request.ride_ids:
+        if ride_id not in rides:
+            raise HTTPException(status_code=404, detail="Ride not found")
+    
+    # Ticks only move in-progress rides, and only ever to completed; a ride
+    # in any other status cannot change until some other request acts on it.
+    pending = {ride_id for ride_id in request.ride_ids
+               if rides[ride_id].status == RideStatus.in_progress}
+    ticks_used = 0
+    while pending and ticks_used < request.max_ticks:
+        pending.difference_update(advance_tick())
+        ticks_used += 1
     
-    return get_state()
+    completed = [ride_id for ride_id in request.ride_ids if rides[ride_id].status == RideStatus.completed]
+    return AdvanceUntilResult(tick=state.tick, ticks_used=ticks_used, completed=completed)
 
 
 @app.post("/reset")
-def reset():
+async def reset():
     """Reset the simulation state."""
-    global state
-    state = GlobalState()
+    state.reset()
     return {"message": "State reset successfully"}
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # httptools comes with uvicorn[standard]; name it explicitly so a missing
+    # extra fails loudly instead of falling back to h11. The loop stays on
+    # uvicorn's "auto", which picks uvloop where the extra installs it (not
+    # on Windows or PyPy). A single worker, since the simulation state is
+    # held in this process.
+    uvicorn.run(app, host="0.0.0.0", port=8000, http="httptools", workers=1)
\ No newline at end of file
@@ -1,8 +1,11 @@
-from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Literal
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Annotated, Container, Optional, List, Dict, KeysView, Literal, Tuple
+from dataclasses import dataclass, field
 from enum import Enum
 import uuid
 
+from app.spatial import GRID_MAX, GridIndex
+
 
 class DriverStatus(str, Enum):
     available = "available"
@@ -21,15 +24,36 @@ class RideStatus(str, Enum):
     failed = "failed"
 
 
+# Grid coordinate accepted from clients. The bound is shared with the spatial
+# index, which sizes its search from it.
+Coordinate = Annotated[int, Field(ge=0, le=GRID_MAX)]
+
+
 class Position(BaseModel):
-    x: int = Field(ge=0, le=99)
-    y: int = Field(ge=0, le=99)
+    x: Coordinate
+    y: Coordinate
+
+
+# Dispatch treats a driver that has never completed a ride as having been
+# idle since before the first tick. Ticks start at 0, so any negative value
+# orders correctly; the API keeps reporting `last_busy_tick: null`.
+NEVER_BUSY_TICK = -1
+
 
+def _new_id() -> str:
+    return str(uuid.uuid4())
 
-class Driver(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    x: int = Field(ge=0, le=99)
-    y: int = Field(ge=0, le=99)
+
+# Simulation entities are slotted dataclasses rather than pydantic models:
+# they are created from already-validated request DTOs and mutated on every
+# tick, so per-instance validation machinery and a __dict__ buy nothing.
+# Pydantic still serializes them (and documents them) at the API boundary.
+
+@dataclass(slots=True, kw_only=True)
+class Driver:
+    id: str = field(default_factory=_new_id)
+    x: int
+    y: int
     status: DriverStatus = DriverStatus.available
     assigned_count: int = 0
     last_busy_tick: Optional[int] = None
@@ -37,20 +61,42 @@ class Driver(BaseModel):
     is_heading_to_dropoff: bool = False  # Track if driver is past pickup phase
 
 
-class Rider(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    x: int = Field(ge=0, le=99)
-    y: int = Field(ge=0, le=99)
+@dataclass(slots=True, kw_only=True)
+class Rider:
+    id: str = field(default_factory=_new_id)
+    x: int
+    y: int
 
 
-class Ride(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+@dataclass(slots=True, kw_only=True)
+class Ride:
+    id: str = field(default_factory=_new_id)
     rider_id: str
     pickup: Position
     dropoff: Position
     status: RideStatus = RideStatus.waiting
     driver_id: Optional[str] = None
-    rejected_driver_ids: List[str] = Field(default_factory=list)
+    rejected_driver_ids: List[str] = field(default_factory=list)
+
+
+class StateSnapshot(BaseModel):
+    tick: int
+    drivers: List[Driver]
+    riders: List[Rider]
+    rides: List[Ride]
+
+
+class TickResult(BaseModel):
+    """Lightweight /tick response: the new tick and what finished on it."""
+    tick: int
+    completed_ride_ids: List[str]
+
+
+class AdvanceUntilResult(BaseModel):
+    """Result of advancing the simulation until a set of rides finished."""
+    tick: int
+    ticks_used: int
+    completed: List[str]
 
 
 class GlobalState(BaseModel):
@@ -58,21 +104,162 @@ class GlobalState(BaseModel):
     drivers: Dict[str, Driver] = Field(default_factory=dict)
     riders: Dict[str, Rider] = Field(default_factory=dict)
     rides: Dict[str, Ride] = Field(default_factory=dict)
+    
+    # Spatial index of drivers whose status is `available`, so dispatch only
+    # visits drivers it could actually assign, nearest first. Available
+    # drivers never move and their fairness fields only change while busy,
+    # so each entry also carries the driver's dispatch tie-breakers.
+    # Kept in sync by the helpers below; driver status must not be changed
+    # by assigning `driver.status` directly.
+    _available: GridIndex = PrivateAttr(default_factory=GridIndex)
+    
+    # Ids of in-progress rides, so tick() does not walk every ride ever
+    # created. Insertion-ordered like the rides dict. Ride status must be
+    # changed through set_ride_status.
+    _active_ride_ids: Dict[str, None] = PrivateAttr(default_factory=dict)
+    
+    # Bumped on every mutation so the encoded snapshot can be reused between
+    # changes. Endpoints that mutate entities directly call mark_changed().
+    _version: int = PrivateAttr(default=0)
+    _snapshot: Optional[Tuple[int, bytes]] = PrivateAttr(default=None)
+    
+    # Source of server-generated ids. Not reset with the state, so ids are
+    # never reused within a process.
+    _last_id: int = PrivateAttr(default=0)
+    
+    @property
+    def available_drivers(self) -> GridIndex:
+        return self._available
+    
+    @property
+    def active_ride_ids(self) -> KeysView[str]:
+        return self._active_ride_ids.keys()
+    
+    def mark_changed(self) -> None:
+        """Invalidate views derived from the state, such as the snapshot."""
+        self._version += 1
+    
+    def snapshot_json(self) -> bytes:
+        """
+        Encode the whole state as a StateSnapshot JSON document.
+        
+        The entities are already valid, so the snapshot is built without
+        validation and encoded by pydantic-core in one pass. The result is
+        cached until the next mutation, so repeated polling is a lookup.
+        """
+        cached = self._snapshot
+        if cached is not None and cached[0] == self._version:
+            return cached[1]
+        
+        body = StateSnapshot.model_construct(
+            tick=self.tick,
+            drivers=list(self.drivers.values()),
+            riders=list(self.riders.values()),
+            rides=list(self.rides.values()),
+        ).model_dump_json().encode()
+        self._snapshot = (self._version, body)
+        return body
+    
+    def new_id(self, prefix: str, taken: Container[str]) -> str:
+        """
+        Return a short id such as `d-12` that is not in `taken`.
+        
+        A counter is all a simulation needs; uuid4 reads the OS random source
+        and formats 36 characters per entity. Client-supplied ids can still
+        collide with the pattern, hence the check against `taken`.
+        """
+        while True:
+            self._last_id += 1
+            new_id = f"{prefix}-{self._last_id}"
+            if new_id not in taken:
+                return new_id
+    
+    def add_driver(self, driver: Driver) -> None:
+        """Register a driver and index it if it is available."""
+        self.mark_changed()
+        self.drivers[driver.id] = driver
+        if driver.status == DriverStatus.available:
+            self._index_available(driver)
+    
+    def remove_driver(self, driver_id: str) -> Driver:
+        """Unregister a driver and drop it from the availability index."""
+        self.mark_changed()
+        self._available.remove(driver_id)
+        return self.drivers.pop(driver_id)
+    
+    def add_rider(self, rider: Rider) -> None:
+        """Register a rider."""
+        self.mark_changed()
+        self.riders[rider.id] = rider
+    
+    def add_ride(self, ride: Ride) -> None:
+        """Register a ride and index it if it is in progress."""
+        self.mark_changed()
+        self.rides[ride.id] = ride
+        if ride.status == RideStatus.in_progress:
+            self._active_ride_ids[ride.id] = None
+    
+    def set_driver_status(self, driver: Driver, status: DriverStatus) -> None:
+        """Change a driver's status, keeping the availability index in sync."""
+        self.mark_changed()
+        driver.status = status
+        if status == DriverStatus.available:
+            self._index_available(driver)
+        else:
+            self._available.remove(driver.id)
+    
+    def _index_available(self, driver: Driver) -> None:
+        # Resolve the None sentinel once here, not per dispatch candidate.
+        last_busy = driver.last_busy_tick if driver.last_busy_tick is not None else NEVER_BUSY_TICK
+        self._available.add(driver.id, driver.x, driver.y, (driver.assigned_count, last_busy))
+    
+    def set_ride_status(self, ride: Ride, status: RideStatus) -> None:
+        """Change a ride's status, keeping the in-progress index in sync."""
+        self.mark_changed()
+        ride.status = status
+        if status == RideStatus.in_progress:
+            self._active_ride_ids[ride.id] = None
+        else:
+            self._active_ride_ids.pop(ride.id, None)
+    
+    def reset(self) -> None:
+        """Clear all entities and indexes in place."""
+        self.mark_changed()
+        self.tick = 0
+        self.drivers.clear()
+        self.riders.clear()
+        self.rides.clear()
+        self._available.clear()
+        self._active_ride_ids.clear()
 
 
 class CreateDriverRequest(BaseModel):
-    x: int = Field(ge=0, le=99)
-    y: int = Field(ge=0, le=99)
+    x: Coordinate
+    y: Coordinate
     id: Optional[str] = None
 
 
 class CreateRiderRequest(BaseModel):
-    x: int = Field(ge=0, le=99)
-    y: int = Field(ge=0, le=99)
+    x: Coordinate
+    y: Coordinate
     id: Optional[str] = None
 
 
+class BulkCreateDriversRequest(BaseModel):
+    items: List[CreateDriverRequest]
+
+
+class BulkCreateRidersRequest(BaseModel):
+    items: List[CreateRiderRequest]
+
+
 class RequestRideRequest(BaseModel):
     rider_id: str
     pickup: Position
-    dropoff: Position
\ No newline at end of file
+    dropoff: Position
+
+
+class AdvanceUntilRequest(BaseModel):
+    ride_ids: List[str]
+    # Bounded so a single request cannot hold the event loop indefinitely
+    max_ticks: int = Field(default=200, ge=0, le=10_000)
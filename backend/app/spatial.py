@@ -0,0 +1,91 @@
+from typing import Any, Dict, Iterator, Tuple
+
+# Grid coordinates are bounded to [0, GRID_MAX] on both axes.
+GRID_MAX = 99
+
+# Side length of a bucket in the grid index. 10 splits the default city
+# into 10x10 buckets, about one driver per bucket at 100 drivers.
+CELL_SIZE = 10
+
+
+def cell_of(x: int, y: int) -> Tuple[int, int]:
+    """Return the grid bucket holding a point."""
+    return x // CELL_SIZE, y // CELL_SIZE
+
+
+def ring_min_distance(r: int) -> int:
+    """
+    Lower bound on the Manhattan distance from a point to anything in the
+    ring of buckets at Chebyshev distance r from the point's own bucket.
+    
+    A bucket r steps away along one axis is separated from the point by at
+    least r - 1 whole buckets plus one unit.
+    """
+    return (r - 1) * CELL_SIZE + 1 if r else 0
+
+
+class GridIndex:
+    """
+    Point index that buckets items into a uniform grid.
+    
+    Each bucket maps item_id to `(x, y, data)`, where `data` is an opaque
+    value stored alongside the point so readers need not look the item up
+    elsewhere. Buckets are insertion-ordered dicts, so iteration order is
+    deterministic. Empty buckets are dropped.
+    """
+    
+    def __init__(self):
+        self._cells: Dict[Tuple[int, int], Dict[str, Tuple[int, int, Any]]] = {}
+        self._cell_by_id: Dict[str, Tuple[int, int]] = {}
+    
+    def __len__(self) -> int:
+        return len(self._cell_by_id)
+    
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._cell_by_id
+    
+    def add(self, item_id: str, x: int, y: int, data: Any = None) -> None:
+        if item_id in self._cell_by_id:
+            self.remove(item_id)
+        cell = cell_of(x, y)
+        self._cell_by_id[item_id] = cell
+        self._cells.setdefault(cell, {})[item_id] = (x, y, data)
+    
+    def remove(self, item_id: str) -> None:
+        cell = self._cell_by_id.pop(item_id, None)
+        if cell is None:
+            return
+        bucket = self._cells[cell]
+        del bucket[item_id]
+        if not bucket:
+            del self._cells[cell]
+    
+    def clear(self) -> None:
+        self._cells.clear()
+        self._cell_by_id.clear()
+    
+    def ring(self, cx: int, cy: int, r: int) -> Iterator[Tuple[str, Tuple[int, int, Any]]]:
+        """
+        Yield (item_id, (x, y, data)) for items in the buckets at Chebyshev
+        distance exactly r from bucket (cx, cy).
+        """
+        cells = self._cells
+        if r == 0:
+            bucket = cells.get((cx, cy))
+            if bucket:
+                yield from bucket.items()
+            return
+        
+        # Top and bottom rows in full, then the left and right columns
+        # between them, so every bucket on the ring is visited once.
+        coords = []
+        for i in range(cx - r, cx + r + 1):
+            coords.append((i, cy - r))
+            coords.append((i, cy + r))
+        for j in range(cy - r + 1, cy + r):
+            coords.append((cx - r, j))
+            coords.append((cx + r, j))
+        for cell in coords:
+            bucket = cells.get(cell)
+            if bucket:
+                yield from bucket.items()
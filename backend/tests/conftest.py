@@ -1,24 +1,41 @@
 import pytest
-import asyncio
+import httpx
 from fastapi.testclient import TestClient
 from app.main import app, state
 from app.models import GlobalState, Driver, Rider, Ride, DriverStatus, RideStatus
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def client():
-    """Create a test client for the FastAPI app."""
-    return TestClient(app)
+    """
+    Create a test client for the FastAPI app, shared by the whole session.
+    
+    The client is entered once, so startup runs once and every request,
+    from any thread, is handled on the same event loop, as in a single
+    server process. It holds no per-test state; isolation comes from
+    clean_state.
+    """
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+async def async_client():
+    """
+    Create an async client that calls the app directly on the test's event loop.
+    
+    Unlike TestClient there is no portal thread to hop through per request,
+    which matters for tests that make many calls in a loop.
+    """
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
 
 
 @pytest.fixture
 def clean_state():
-    """Reset the global state before each test."""
-    global state
-    state.drivers.clear()
-    state.riders.clear() 
-    state.rides.clear()
-    state.tick = 0
+    """Reset the global state in place before each test."""
+    state.reset()
     yield state
 
 
@@ -27,7 +44,7 @@ def sample_driver(clean_state):
     """Create a sample driver for testing."""
     from app.models import Driver
     driver = Driver(x=25, y=25)
-    clean_state.drivers[driver.id] = driver
+    clean_state.add_driver(driver)
     return driver
 
 
@@ -36,7 +53,7 @@ def sample_rider(clean_state):
     """Create a sample rider for testing."""
     from app.models import Rider
     rider = Rider(x=50, y=50)
-    clean_state.riders[rider.id] = rider
+    clean_state.add_rider(rider)
     return rider
 
 
@@ -48,7 +65,7 @@ def multiple_drivers(clean_state):
     
     for x, y in positions:
         driver = Driver(x=x, y=y)
-        clean_state.drivers[driver.id] = driver
+        clean_state.add_driver(driver)
         drivers.append(driver)
     
     return drivers
@@ -62,17 +79,85 @@ def multiple_riders(clean_state):
     
     for x, y in positions:
         rider = Rider(x=x, y=y)
-        clean_state.riders[rider.id] = rider
+        clean_state.add_rider(rider)
         riders.append(rider)
     
     return riders
 
 
+@pytest.fixture
+def seed_entities(clean_state):
+    """
+    Return a helper that adds drivers and riders straight to the state.
+    
+    Bulk setup through the API pays routing and validation per entity;
+    tests that only need a populated world should seed it directly.
+    """
+    def seed(driver_positions=(), rider_positions=()):
+        drivers = []
+        for x, y in driver_positions:
+            driver = Driver(x=x, y=y)
+            clean_state.add_driver(driver)
+            drivers.append(driver)
+        
+        riders = []
+        for x, y in rider_positions:
+            rider = Rider(x=x, y=y)
+            clean_state.add_rider(rider)
+            riders.append(rider)
+        
+        return drivers, riders
+    
+    return seed
+
+
+@pytest.fixture
+async def accepted_ride(request, async_client, clean_state):
+    """
+    Create a driver and a rider, then request and accept a ride for them.
+    
+    Parametrize indirectly with `(driver_xy, pickup_xy, dropoff_xy)`; the
+    rider waits at the pickup. Returns the ids and the start positions.
+    """
+    (driver_x, driver_y), (pickup_x, pickup_y), (dropoff_x, dropoff_y) = request.param
+    
+    driver_response = await async_client.post("/drivers", json={"x": driver_x, "y": driver_y})
+    assert driver_response.status_code == 200
+    driver_id = driver_response.json()["driver"]["id"]
+    
+    rider_response = await async_client.post("/riders", json={"x": pickup_x, "y": pickup_y})
+    assert rider_response.status_code == 200
+    rider_id = rider_response.json()["rider"]["id"]
+    
+    ride_response = await async_client.post("/rides/request", json={
+        "rider_id": rider_id,
+        "pickup": {"x": pickup_x, "y": pickup_y},
+        "dropoff": {"x": dropoff_x, "y": dropoff_y}
+    })
+    assert ride_response.status_code == 200
+    ride_data = ride_response.json()["ride"]
+    assert ride_data["status"] == "awaiting_accept"
+    assert ride_data["driver_id"] == driver_id
+    
+    accept_response = await async_client.post(f"/rides/{ride_data['id']}/accept")
+    assert accept_response.status_code == 200
+    assert accept_response.json()["ride"]["status"] == "in_progress"
+    
+    return {
+        "driver_id": driver_id,
+        "rider_id": rider_id,
+        "ride_id": ride_data["id"],
+        "driver": (driver_x, driver_y),
+        "pickup": (pickup_x, pickup_y),
+        "dropoff": (dropoff_x, dropoff_y),
+    }
+
+
 @pytest.fixture
 def busy_driver(clean_state):
     """Create a driver that is currently on a trip."""
     driver = Driver(x=25, y=25, status=DriverStatus.on_trip, assigned_count=5, last_busy_tick=10)
-    clean_state.drivers[driver.id] = driver
+    clean_state.add_driver(driver)
     return driver
 
 
@@ -80,10 +165,23 @@ def busy_driver(clean_state):
 def offline_driver(clean_state):
     """Create an offline driver."""
     driver = Driver(x=25, y=25, status=DriverStatus.offline)
-    clean_state.drivers[driver.id] = driver
+    clean_state.add_driver(driver)
     return driver
 
 
+def index_state(state_data):
+    """
+    Index a /state (or /tick) response body by entity id.
+    
+    Returns {"drivers": {id: driver}, "riders": {id: rider}, "rides": {id: ride}},
+    so a test can look several entities up without scanning the lists.
+    """
+    return {
+        kind: {entity["id"]: entity for entity in state_data[kind]}
+        for kind in ("drivers", "riders", "rides")
+    }
+
+
 class TestScenario:
     """Helper class for creating complex test scenarios."""
     
@@ -96,7 +194,7 @@ class TestScenario:
             pickup=Position(x=pickup_x, y=pickup_y),
             dropoff=Position(x=dropoff_x, y=dropoff_y)
         )
-        state.rides[ride.id] = ride
+        state.add_ride(ride)
         return ride
     
     @staticmethod
@@ -105,10 +203,10 @@ class TestScenario:
         driver = state.drivers[driver_id]
         ride = state.rides[ride_id]
         
-        driver.status = DriverStatus.assigned
+        state.set_driver_status(driver, DriverStatus.assigned)
         driver.current_ride_id = ride_id
         ride.driver_id = driver_id
-        ride.status = RideStatus.awaiting_accept
+        state.set_ride_status(ride, RideStatus.awaiting_accept)
 
 
 @pytest.fixture
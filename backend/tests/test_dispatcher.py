@@ -0,0 +1,74 @@
+import random
+from app.dispatcher import Dispatcher, manhattan_distance
+from app.models import Driver, DriverStatus, GlobalState, NEVER_BUSY_TICK, Ride, Position
+
+
+def make_ride(pickup_x: int, pickup_y: int, rejected_driver_ids=()) -> Ride:
+    return Ride(
+        rider_id="r-1",
+        pickup=Position(x=pickup_x, y=pickup_y),
+        dropoff=Position(x=0, y=0),
+        rejected_driver_ids=list(rejected_driver_ids),
+    )
+
+
+def reference_key(driver: Driver, ride: Ride):
+    """Dispatch sort key computed per driver, as a full scan would."""
+    last_busy = driver.last_busy_tick if driver.last_busy_tick is not None else NEVER_BUSY_TICK
+    eta = manhattan_distance(driver.x, driver.y, ride.pickup.x, ride.pickup.y)
+    return (eta, driver.assigned_count, last_busy)
+
+
+class TestDispatcher:
+    """Test the bucketed driver search against the plain dispatch ordering."""
+
+    def test_nearer_driver_in_next_bucket_wins(self):
+        """Test that a hit in the pickup's bucket does not end the search early."""
+        state = GlobalState()
+        state.add_driver(Driver(id="same-bucket", x=10, y=10))  # ETA 14
+        state.add_driver(Driver(id="next-bucket", x=20, y=15))  # ETA 1, across the x=20 boundary
+        
+        assert Dispatcher.select_best_driver(make_ride(19, 15), state) == "next-bucket"
+
+    def test_equal_eta_driver_in_outer_bucket_wins_on_fairness(self):
+        """Test that equal-ETA drivers in outer buckets still compete on the tie-breakers."""
+        state = GlobalState(tick=10)
+        state.add_driver(Driver(id="busier", x=14, y=15, assigned_count=1))
+        state.add_driver(Driver(id="fewer-rides", x=24, y=15, assigned_count=0, last_busy_tick=5))
+        state.add_driver(Driver(id="recently-busy", x=19, y=10, assigned_count=0, last_busy_tick=8))
+        
+        assert Dispatcher.select_best_driver(make_ride(19, 15), state) == "fewer-rides"
+        
+        state.add_driver(Driver(id="idle-longer", x=19, y=20, assigned_count=0, last_busy_tick=2))
+        assert Dispatcher.select_best_driver(make_ride(19, 15), state) == "idle-longer"
+
+    def test_matches_full_scan_on_random_worlds(self):
+        """Test that dispatch picks a driver with the minimal key over all eligible drivers."""
+        rng = random.Random(7)
+        for _ in range(500):
+            state = GlobalState(tick=rng.randint(0, 50))
+            # A small span crowds drivers into few buckets; the full grid spreads them out
+            span = rng.choice([15, 99])
+            for _ in range(rng.randint(0, 40)):
+                state.add_driver(Driver(
+                    x=rng.randint(0, span),
+                    y=rng.randint(0, span),
+                    status=rng.choice(list(DriverStatus)),
+                    assigned_count=rng.randint(0, 2),
+                    last_busy_tick=rng.choice([None, rng.randint(0, 50)]),
+                ))
+            driver_ids = list(state.drivers)
+            rejected = rng.sample(driver_ids, min(len(driver_ids), rng.randint(0, 3)))
+            ride = make_ride(rng.randint(0, span), rng.randint(0, span), rejected)
+            
+            eligible = [
+                driver for driver in state.drivers.values()
+                if driver.status == DriverStatus.available and driver.id not in rejected
+            ]
+            driver_id = Dispatcher.select_best_driver(ride, state)
+            
+            if not eligible:
+                assert driver_id is None
+                continue
+            best_key = min(reference_key(driver, ride) for driver in eligible)
+            assert reference_key(state.drivers[driver_id], ride) == best_key
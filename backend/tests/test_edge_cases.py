@@ -1,6 +1,7 @@
 import pytest
-from fastapi.testclient import TestClient
+from concurrent.futures import ThreadPoolExecutor
 from app.models import DriverStatus, RideStatus
+from tests.conftest import index_state
 
 
 class TestEdgeCases:
@@ -66,8 +67,9 @@ class TestEdgeCases:
             "pickup": {"x": 45, "y": 45},
             "dropoff": {"x": 55, "y": 55}
         })
-        ride_id = ride_response.json()["ride"]["id"]
-        first_driver_id = ride_response.json()["ride"]["driver_id"]
+        ride_data = ride_response.json()["ride"]
+        ride_id = ride_data["id"]
+        first_driver_id = ride_data["driver_id"]
         
         # First driver rejects
         reject_response = client.post(f"/rides/{ride_id}/reject")
@@ -134,6 +136,52 @@ class TestEdgeCases:
         })
         assert invalid_ride_response.status_code == 422
 
+    def test_bulk_create_rejects_taken_ids(self, client, clean_state):
+        """Test that a bulk create with a taken or repeated id creates nothing."""
+        client.post("/drivers", json={"x": 10, "y": 10, "id": "d-taken"})
+        
+        taken_response = client.post("/drivers/bulk", json={
+            "items": [{"x": 20, "y": 20}, {"x": 30, "y": 30, "id": "d-taken"}]
+        })
+        assert taken_response.status_code == 400
+        
+        repeated_response = client.post("/riders/bulk", json={
+            "items": [{"x": 20, "y": 20, "id": "r-twice"}, {"x": 30, "y": 30, "id": "r-twice"}]
+        })
+        assert repeated_response.status_code == 400
+        
+        state_data = client.get("/state").json()
+        assert [d["id"] for d in state_data["drivers"]] == ["d-taken"]
+        assert state_data["riders"] == []
+        
+        # An explicit id later in the batch is reserved before ids are generated
+        next_id = clean_state._last_id + 1
+        driver_response = client.post("/drivers/bulk", json={
+            "items": [{"x": 1, "y": 1}, {"x": 2, "y": 2, "id": f"d-{next_id}"}]
+        })
+        assert driver_response.status_code == 200
+        driver_ids = [d["id"] for d in driver_response.json()["drivers"]]
+        assert len(set(driver_ids)) == 2
+        assert set(driver_ids) <= set(clean_state.drivers)
+        
+        next_id = clean_state._last_id + 1
+        rider_response = client.post("/riders/bulk", json={
+            "items": [{"x": 1, "y": 1}, {"x": 2, "y": 2, "id": f"r-{next_id}"}]
+        })
+        assert rider_response.status_code == 200
+        rider_ids = [r["id"] for r in rider_response.json()["riders"]]
+        assert len(set(rider_ids)) == 2
+        assert set(rider_ids) == set(clean_state.riders)
+
+    def test_scenario_ride_visible_after_cached_state(self, client, clean_state, sample_rider, test_scenario):
+        """Test that a ride added by the scenario helper shows up in a cached /state."""
+        assert client.get("/state").json()["rides"] == []
+        
+        ride = test_scenario.create_pending_ride(sample_rider.id, 50, 50, 60, 60, clean_state)
+        
+        state_data = client.get("/state").json()
+        assert [r["id"] for r in state_data["rides"]] == [ride.id]
+
     def test_nonexistent_rider_ride_request(self, client, clean_state):
         """Test ride request for non-existent rider."""
         ride_response = client.post("/rides/request", json={
@@ -186,7 +234,7 @@ class TestEdgeCases:
         # Check that ride is marked as failed
         state_response = client.get("/state")
         state_data = state_response.json()
-        ride = next(r for r in state_data["rides"] if r["id"] == ride_id)
+        ride = index_state(state_data)["rides"][ride_id]
         assert ride["status"] == "failed"
         assert ride["driver_id"] is None
 
@@ -208,8 +256,9 @@ class TestEdgeCases:
         # Check that ride is marked as failed and driver is freed
         state_response = client.get("/state")
         state_data = state_response.json()
-        ride = next(r for r in state_data["rides"] if r["id"] == ride_id)
-        driver = next(d for d in state_data["drivers"] if d["id"] == sample_driver.id)
+        by_id = index_state(state_data)
+        ride = by_id["rides"][ride_id]
+        driver = by_id["drivers"][sample_driver.id]
         
         assert ride["status"] == "failed"
         assert driver["status"] == "available"
@@ -244,18 +293,14 @@ class TestEdgeCases:
         rider1_id = rider1_resp.json()["rider"]["id"]
         rider2_id = rider2_resp.json()["rider"]["id"]
         
-        # Request rides simultaneously (in quick succession)
-        ride1_resp = client.post("/rides/request", json={
-            "rider_id": rider1_id,
-            "pickup": {"x": 20, "y": 20},
-            "dropoff": {"x": 30, "y": 30}
-        })
-        
-        ride2_resp = client.post("/rides/request", json={
-            "rider_id": rider2_id,
-            "pickup": {"x": 21, "y": 21},
-            "dropoff": {"x": 31, "y": 31}
-        })
+        # Request rides simultaneously from two threads
+        payloads = [
+            {"rider_id": rider1_id, "pickup": {"x": 20, "y": 20}, "dropoff": {"x": 30, "y": 30}},
+            {"rider_id": rider2_id, "pickup": {"x": 21, "y": 21}, "dropoff": {"x": 31, "y": 31}},
+        ]
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(client.post, "/rides/request", json=p) for p in payloads]
+            ride1_resp, ride2_resp = (f.result() for f in futures)
         
         # Only one should get the driver, the other should fail
         ride1_data = ride1_resp.json()["ride"]
@@ -265,4 +310,28 @@ class TestEdgeCases:
         failed_rides = [r for r in [ride1_data, ride2_data] if r["status"] == "failed"]
         
         assert len(assigned_rides) == 1, "Only one ride should be assigned"
-        assert len(failed_rides) == 1, "One ride should fail"
\ No newline at end of file
+        assert len(failed_rides) == 1, "One ride should fail"
+
+    def test_dispatch_nearest_driver_far_from_pickup(self, client, clean_state):
+        """Test that dispatch finds the nearest driver outside the initial search area."""
+        # Drivers spread across the grid, none close to the pickup
+        far_ids = []
+        for x, y in [(0, 0), (99, 99), (0, 99), (63, 64)]:
+            resp = client.post("/drivers", json={"x": x, "y": y})
+            far_ids.append(resp.json()["driver"]["id"])
+        
+        nearest_resp = client.post("/drivers", json={"x": 90, "y": 10})
+        nearest_id = nearest_resp.json()["driver"]["id"]
+        
+        rider_resp = client.post("/riders", json={"x": 64, "y": 10})
+        rider_id = rider_resp.json()["rider"]["id"]
+        
+        ride_response = client.post("/rides/request", json={
+            "rider_id": rider_id,
+            "pickup": {"x": 64, "y": 10},
+            "dropoff": {"x": 70, "y": 20}
+        })
+        
+        ride_data = ride_response.json()["ride"]
+        assert ride_data["status"] == "awaiting_accept"
+        assert ride_data["driver_id"] == nearest_id
@@ -1,125 +1,171 @@
 import pytest
-from fastapi.testclient import TestClient
+from app.main import advance_tick
 from app.models import DriverStatus, RideStatus
+from tests.conftest import index_state
 
+# (driver, pickup, dropoff) positions for rides that run to completion; the
+# rider waits at the pickup. See the accepted_ride fixture.
+RIDE_SCENARIOS = [
+    ((10, 10), (15, 15), (25, 25)),
+    ((20, 20), (20, 20), (30, 30)),
+    ((45, 45), (50, 50), (55, 55)),
+]
+RIDE_SCENARIO_IDS = ["driver-away-from-pickup", "driver-at-pickup", "short-trip"]
 
+
+def ticks_to_complete(driver_xy, pickup_xy, dropoff_xy):
+    """Tick on which an accepted ride completes: one unit per tick, via the pickup."""
+    (driver_x, driver_y), (pickup_x, pickup_y), (dropoff_x, dropoff_y) = driver_xy, pickup_xy, dropoff_xy
+    distance = (abs(pickup_x - driver_x) + abs(pickup_y - driver_y)
+                + abs(dropoff_x - pickup_x) + abs(dropoff_y - pickup_y))
+    # A zero-length trip still takes the tick that completes it
+    return max(distance, 1)
+
+
+async def complete_ride(async_client, rider_id, pickup_xy, dropoff_xy):
+    """Request, accept and run a ride to completion; return its driver's id."""
+    (pickup_x, pickup_y), (dropoff_x, dropoff_y) = pickup_xy, dropoff_xy
+    ride_response = await async_client.post("/rides/request", json={
+        "rider_id": rider_id,
+        "pickup": {"x": pickup_x, "y": pickup_y},
+        "dropoff": {"x": dropoff_x, "y": dropoff_y}
+    })
+    ride_data = ride_response.json()["ride"]
+    assert ride_data["status"] == "awaiting_accept"
+    accept_response = await async_client.post(f"/rides/{ride_data['id']}/accept")
+    assert accept_response.status_code == 200
+    
+    max_ticks = 200
+    pending = {ride_data["id"]}
+    for _ in range(max_ticks):
+        pending.difference_update(advance_tick())
+        if not pending:
+            break
+    assert not pending, "Ride should complete"
+    return ride_data["driver_id"]
+
+
+@pytest.mark.ride_flow
 class TestCompleteRideFlow:
     """Test complete ride flows from start to finish."""
 
-    def test_happy_path_complete_ride_flow(self, client, clean_state):
+    @pytest.mark.parametrize("accepted_ride", RIDE_SCENARIOS, ids=RIDE_SCENARIO_IDS, indirect=True)
+    async def test_happy_path_complete_ride_flow(self, async_client, accepted_ride):
         """Test a complete successful ride from request to completion."""
-        # Step 1: Create driver and rider
-        driver_response = client.post("/drivers", json={"x": 10, "y": 10})
-        assert driver_response.status_code == 200
-        driver_id = driver_response.json()["driver"]["id"]
-        
-        rider_response = client.post("/riders", json={"x": 15, "y": 15})
-        assert rider_response.status_code == 200
-        rider_id = rider_response.json()["rider"]["id"]
+        driver_id = accepted_ride["driver_id"]
+        ride_id = accepted_ride["ride_id"]
+        dropoff_x, dropoff_y = accepted_ride["dropoff"]
+        expected_ticks = ticks_to_complete(accepted_ride["driver"], accepted_ride["pickup"], accepted_ride["dropoff"])
         
-        # Step 2: Request a ride
-        ride_response = client.post("/rides/request", json={
-            "rider_id": rider_id,
-            "pickup": {"x": 15, "y": 15},
-            "dropoff": {"x": 25, "y": 25}
-        })
-        assert ride_response.status_code == 200
-        ride_data = ride_response.json()["ride"]
-        ride_id = ride_data["id"]
-        assert ride_data["status"] == "awaiting_accept"
-        assert ride_data["driver_id"] == driver_id
-        
-        # Step 3: Accept the ride
-        accept_response = client.post(f"/rides/{ride_id}/accept")
-        assert accept_response.status_code == 200
-        assert accept_response.json()["ride"]["status"] == "in_progress"
-        
-        # Step 4: Verify driver status changed
-        state_response = client.get("/state")
-        state_data = state_response.json()
-        driver = next(d for d in state_data["drivers"] if d["id"] == driver_id)
+        # Verify driver status changed on accept
+        state_data = (await async_client.get("/state")).json()
+        driver = index_state(state_data)["drivers"][driver_id]
         assert driver["status"] == "on_trip"
         assert driver["assigned_count"] == 1
         
-        # Step 5: Simulate movement until completion
-        max_ticks = 50  # Safety limit
-        tick_count = 0
-        
-        while tick_count < max_ticks:
-            tick_response = client.post("/tick")
-            assert tick_response.status_code == 200
-            
-            state_data = tick_response.json()
-            ride = next(r for r in state_data["rides"] if r["id"] == ride_id)
-            
-            if ride["status"] == "completed":
-                break
-            
-            tick_count += 1
+        # Simulate movement until completion, in one request
+        max_ticks = expected_ticks + 2  # Safety limit
+        advance_response = await async_client.post("/tick/advance_until", json={
+            "ride_ids": [ride_id],
+            "max_ticks": max_ticks
+        })
+        assert advance_response.status_code == 200
+        assert advance_response.json()["ticks_used"] == expected_ticks
         
-        # Step 6: Verify final state
-        assert ride["status"] == "completed"
-        final_driver = next(d for d in state_data["drivers"] if d["id"] == driver_id)
+        # Verify final state
+        state_data = (await async_client.get("/state")).json()
+        final_state = index_state(state_data)
+        assert final_state["rides"][ride_id]["status"] == "completed"
+        final_driver = final_state["drivers"][driver_id]
         assert final_driver["status"] == "available"
-        assert final_driver["x"] == 25
-        assert final_driver["y"] == 25
+        assert final_driver["x"] == dropoff_x
+        assert final_driver["y"] == dropoff_y
         assert final_driver["last_busy_tick"] == state_data["tick"]
         
         # Verify rider moved to dropoff
-        final_rider = next(r for r in state_data["riders"] if r["id"] == rider_id)
-        assert final_rider["x"] == 25
-        assert final_rider["y"] == 25
+        final_rider = final_state["riders"][accepted_ride["rider_id"]]
+        assert final_rider["x"] == dropoff_x
+        assert final_rider["y"] == dropoff_y
 
-    def test_ride_with_driver_at_pickup_location(self, client, clean_state):
+    @pytest.mark.parametrize("accepted_ride", [RIDE_SCENARIOS[1]], ids=[RIDE_SCENARIO_IDS[1]], indirect=True)
+    async def test_ride_with_driver_at_pickup_location(self, async_client, accepted_ride):
         """Test ride where driver is already at pickup location."""
-        # Create driver at pickup location
-        driver_response = client.post("/drivers", json={"x": 20, "y": 20})
-        driver_id = driver_response.json()["driver"]["id"]
+        # First tick should immediately start moving to dropoff
+        tick_response = await async_client.post("/tick")
+        state_data = tick_response.json()
+        driver = index_state(state_data)["drivers"][accepted_ride["driver_id"]]
         
-        # Create rider at same location
-        rider_response = client.post("/riders", json={"x": 20, "y": 20})
-        rider_id = rider_response.json()["rider"]["id"]
+        # Driver should be moving toward dropoff (not staying at pickup)
+        assert driver["x"] == 21 or driver["y"] == 21  # Should have moved
+
+    async def test_tick_without_state_reports_completed_rides(self, async_client, clean_state):
+        """Test the lightweight /tick response lists rides completed on that tick."""
+        await async_client.post("/drivers", json={"x": 20, "y": 20})
+        rider_id = (await async_client.post("/riders", json={"x": 20, "y": 20})).json()["rider"]["id"]
         
-        # Request ride
-        ride_response = client.post("/rides/request", json={
+        # Dropoff one step from pickup, so the ride completes on the first tick
+        ride_response = await async_client.post("/rides/request", json={
             "rider_id": rider_id,
             "pickup": {"x": 20, "y": 20},
-            "dropoff": {"x": 30, "y": 30}
+            "dropoff": {"x": 21, "y": 20}
         })
         ride_id = ride_response.json()["ride"]["id"]
+        await async_client.post(f"/rides/{ride_id}/accept")
         
-        # Accept ride
-        client.post(f"/rides/{ride_id}/accept")
+        tick_response = await async_client.post("/tick", params={"include_state": "false"})
+        assert tick_response.status_code == 200
+        assert tick_response.json() == {"tick": 1, "completed_ride_ids": [ride_id]}
         
-        # First tick should immediately start moving to dropoff
-        tick_response = client.post("/tick")
-        state_data = tick_response.json()
-        driver = next(d for d in state_data["drivers"] if d["id"] == driver_id)
+        tick_response = await async_client.post("/tick", params={"include_state": "false"})
+        assert tick_response.json() == {"tick": 2, "completed_ride_ids": []}
+
+    async def test_advance_until_rides_finish(self, async_client, clean_state):
+        """Test advancing the simulation in one request until a ride completes."""
+        await async_client.post("/drivers", json={"x": 10, "y": 10})
+        rider_id = (await async_client.post("/riders", json={"x": 12, "y": 10})).json()["rider"]["id"]
         
-        # Driver should be moving toward dropoff (not staying at pickup)
-        assert driver["x"] == 21 or driver["y"] == 21  # Should have moved
+        ride_response = await async_client.post("/rides/request", json={
+            "rider_id": rider_id,
+            "pickup": {"x": 12, "y": 10},
+            "dropoff": {"x": 12, "y": 15}
+        })
+        ride_id = ride_response.json()["ride"]["id"]
+        await async_client.post(f"/rides/{ride_id}/accept")
+        
+        # 2 ticks to the pickup, 5 more to the dropoff
+        response = await async_client.post("/tick/advance_until", json={"ride_ids": [ride_id], "max_ticks": 50})
+        assert response.status_code == 200
+        assert response.json() == {"tick": 7, "ticks_used": 7, "completed": [ride_id]}
+        
+        # Nothing left in progress, so no further ticks are run
+        response = await async_client.post("/tick/advance_until", json={"ride_ids": [ride_id]})
+        assert response.json()["ticks_used"] == 0
+        
+        response = await async_client.post("/tick/advance_until", json={"ride_ids": ["no-such-ride"]})
+        assert response.status_code == 404
 
-    def test_multiple_concurrent_rides(self, client, clean_state):
+    async def test_multiple_concurrent_rides(self, async_client, clean_state):
         """Test multiple rides happening simultaneously."""
-        # Create 4 drivers and riders
-        drivers = []
-        riders = []
+        # Create 4 drivers and riders, one bulk request each
         positions = [(10, 10), (30, 30), (70, 70), (90, 90)]
         
-        for x, y in positions:
-            driver_resp = client.post("/drivers", json={"x": x, "y": y})
-            drivers.append(driver_resp.json()["driver"])
-            
-            # Keep rider coordinates within bounds (max 99)
-            rider_x = min(x + 10, 99)
-            rider_y = min(y + 10, 99)
-            rider_resp = client.post("/riders", json={"x": rider_x, "y": rider_y})
-            riders.append(rider_resp.json()["rider"])
+        driver_resp = await async_client.post("/drivers/bulk", json={
+            "items": [{"x": x, "y": y} for x, y in positions]
+        })
+        drivers = driver_resp.json()["drivers"]
+        
+        # Keep rider coordinates within bounds (max 99)
+        rider_resp = await async_client.post("/riders/bulk", json={
+            "items": [{"x": min(x + 10, 99), "y": min(y + 10, 99)} for x, y in positions]
+        })
+        riders = rider_resp.json()["riders"]
         
         # Create 4 rides for 4 driver-rider pairs
+        driver_positions = {driver["id"]: (driver["x"], driver["y"]) for driver in drivers}
         rides = []
+        expected_ticks = 0
         for i, (driver, rider) in enumerate(zip(drivers, riders)):
-            ride_response = client.post("/rides/request", json={
+            ride_response = await async_client.post("/rides/request", json={
                 "rider_id": rider["id"],
                 "pickup": {"x": rider["x"], "y": rider["y"]},
                 "dropoff": {"x": min(rider["x"] + 10, 99), "y": min(rider["y"] + 10, 99)}
@@ -127,47 +173,45 @@ class TestCompleteRideFlow:
             assert ride_response.status_code == 200, f"Ride request failed: {ride_response.json()}"
             ride_data = ride_response.json()["ride"]
             rides.append(ride_data)
+            expected_ticks = max(expected_ticks, ticks_to_complete(
+                driver_positions[ride_data["driver_id"]],
+                (ride_data["pickup"]["x"], ride_data["pickup"]["y"]),
+                (ride_data["dropoff"]["x"], ride_data["dropoff"]["y"]),
+            ))
             
             # Accept each ride
-            client.post(f"/rides/{ride_data['id']}/accept")
+            await async_client.post(f"/rides/{ride_data['id']}/accept")
         
-        # Simulate until all rides complete
-        max_ticks = 100
+        # Simulate until all rides complete, calling the simulation directly
+        max_ticks = expected_ticks + 2
         completed_rides = set()
-        
         for _ in range(max_ticks):
-            tick_response = client.post("/tick")
-            state_data = tick_response.json()
-            
-            for ride in state_data["rides"]:
-                if ride["status"] == "completed":
-                    completed_rides.add(ride["id"])
-            
-            if len(completed_rides) == 4:
+            completed_rides.update(advance_tick())
+            if len(completed_rides) == len(rides):
                 break
         
         assert len(completed_rides) == 4, "All rides should complete"
+        assert clean_state.tick == expected_ticks, "Last ride should complete on the expected tick"
+        assert all(clean_state.rides[ride_id].status == RideStatus.completed for ride_id in completed_rides)
 
-    def test_dispatch_algorithm_fairness(self, client, clean_state):
+    async def test_dispatch_algorithm_fairness(self, async_client, clean_state):
         """Test that dispatch algorithm fairly distributes rides."""
         # Create drivers with different assigned counts
-        driver1_resp = client.post("/drivers", json={"x": 10, "y": 10})
+        driver1_resp = await async_client.post("/drivers", json={"x": 10, "y": 10})
         driver1_id = driver1_resp.json()["driver"]["id"]
         
-        driver2_resp = client.post("/drivers", json={"x": 11, "y": 11})
+        driver2_resp = await async_client.post("/drivers", json={"x": 11, "y": 11})
         driver2_id = driver2_resp.json()["driver"]["id"]
         
-        # Get state and manually update driver assigned counts via the state objects
-        state_resp = client.get("/state")
-        # We can't directly modify the test client state, so we'll work with what we have
-        # The dispatch algorithm will still work based on the current assigned counts
+        # Both drivers start with the same assigned count; the dispatch
+        # algorithm works from the counts as they are
         
         # Create rider
-        rider_resp = client.post("/riders", json={"x": 15, "y": 15})
+        rider_resp = await async_client.post("/riders", json={"x": 15, "y": 15})
         rider_id = rider_resp.json()["rider"]["id"]
         
         # Request ride - should go to driver2 (less assigned rides)
-        ride_response = client.post("/rides/request", json={
+        ride_response = await async_client.post("/rides/request", json={
             "rider_id": rider_id,
             "pickup": {"x": 15, "y": 15},
             "dropoff": {"x": 25, "y": 25}
@@ -178,44 +222,68 @@ class TestCompleteRideFlow:
         # Both drivers are equally close, so just ensure it gets assigned to one of them
         assert ride_data["driver_id"] in [driver1_id, driver2_id], "Should assign to one of the available drivers"
 
-    def test_ride_completion_metrics(self, client, clean_state):
-        """Test that completion properly updates all metrics."""
-        # Create driver and rider for this test (closer together for faster completion)
-        driver_resp = client.post("/drivers", json={"x": 45, "y": 45})
-        driver_id = driver_resp.json()["driver"]["id"]
+    async def test_dispatch_prefers_fewer_assignments(self, async_client, clean_state):
+        """Test that an equidistant driver with fewer accepted rides wins, even if idle for less time."""
+        rider_id = (await async_client.post("/riders", json={"x": 0, "y": 0})).json()["rider"]["id"]
         
-        rider_resp = client.post("/riders", json={"x": 50, "y": 50})
-        rider_id = rider_resp.json()["rider"]["id"]
+        # Driver A completes two rides, ending at (20, 15) on tick 4
+        driver_a = (await async_client.post("/drivers", json={"x": 16, "y": 15})).json()["driver"]["id"]
+        assert await complete_ride(async_client, rider_id, (16, 15), (18, 15)) == driver_a
+        assert await complete_ride(async_client, rider_id, (18, 15), (20, 15)) == driver_a
         
-        # Request and complete a ride
-        ride_response = client.post("/rides/request", json={
+        # Driver B completes one ride later, ending at (30, 15) on tick 14
+        driver_b = (await async_client.post("/drivers", json={"x": 40, "y": 15})).json()["driver"]["id"]
+        assert await complete_ride(async_client, rider_id, (40, 15), (30, 15)) == driver_b
+        
+        # Both are 5 away. A sits in the pickup's own grid bucket and has been
+        # idle longer, so only its higher assigned count rules it out.
+        ride_response = await async_client.post("/rides/request", json={
             "rider_id": rider_id,
-            "pickup": {"x": 50, "y": 50},
-            "dropoff": {"x": 55, "y": 55}
+            "pickup": {"x": 25, "y": 15},
+            "dropoff": {"x": 25, "y": 20}
         })
-        assert ride_response.status_code == 200, f"Ride request failed: {ride_response.json()}"
-        ride_id = ride_response.json()["ride"]["id"]
+        assert ride_response.json()["ride"]["driver_id"] == driver_b
+
+    async def test_dispatch_prefers_longest_idle(self, async_client, clean_state):
+        """Test that of two equidistant drivers with equal assignments, the one idle longer wins."""
+        rider_id = (await async_client.post("/riders", json={"x": 0, "y": 0})).json()["rider"]["id"]
         
-        client.post(f"/rides/{ride_id}/accept")
+        # Driver B completes a ride ending at (30, 15) on tick 6
+        driver_b = (await async_client.post("/drivers", json={"x": 36, "y": 15})).json()["driver"]["id"]
+        assert await complete_ride(async_client, rider_id, (36, 15), (30, 15)) == driver_b
         
-        # Get initial tick
-        initial_state = client.get("/state").json()
-        initial_tick = initial_state["tick"]
+        # Driver A completes a ride ending at (20, 15) on tick 16
+        driver_a = (await async_client.post("/drivers", json={"x": 10, "y": 15})).json()["driver"]["id"]
+        assert await complete_ride(async_client, rider_id, (10, 15), (20, 15)) == driver_a
         
-        # Complete the ride
-        max_ticks = 50
+        # Both are 5 away with one ride each; A sits in the pickup's own grid
+        # bucket, but B has been idle since an earlier tick
+        ride_response = await async_client.post("/rides/request", json={
+            "rider_id": rider_id,
+            "pickup": {"x": 25, "y": 15},
+            "dropoff": {"x": 25, "y": 20}
+        })
+        assert ride_response.json()["ride"]["driver_id"] == driver_b
+
+    @pytest.mark.parametrize("accepted_ride", RIDE_SCENARIOS, ids=RIDE_SCENARIO_IDS, indirect=True)
+    async def test_ride_completion_metrics(self, accepted_ride, clean_state):
+        """Test that completion properly updates all metrics."""
+        # Complete the ride, calling the simulation directly
+        expected_ticks = ticks_to_complete(accepted_ride["driver"], accepted_ride["pickup"], accepted_ride["dropoff"])
+        max_ticks = expected_ticks + 2
+        ride = clean_state.rides[accepted_ride["ride_id"]]
         for _ in range(max_ticks):
-            tick_response = client.post("/tick")
-            state_data = tick_response.json()
-            ride = next(r for r in state_data["rides"] if r["id"] == ride_id)
-            
-            if ride["status"] == "completed":
+            if ride.status == RideStatus.completed:
                 break
+            advance_tick()
         
         # Verify all completion metrics
-        final_driver = next(d for d in state_data["drivers"] if d["id"] == driver_id)
-        assert final_driver["assigned_count"] == 1, "Assigned count should increment"
-        assert final_driver["last_busy_tick"] == state_data["tick"], "Last busy tick should update"
-        assert final_driver["is_heading_to_dropoff"] == False, "Should reset heading flag"
-        assert final_driver["current_ride_id"] is None, "Should clear current ride"
-        assert final_driver["status"] == "available", "Should return to available"
\ No newline at end of file
+        final_driver = clean_state.drivers[accepted_ride["driver_id"]]
+        assert ride.status == RideStatus.completed
+        assert clean_state.tick == expected_ticks, "Ride should complete on the expected tick"
+        assert final_driver.assigned_count == 1, "Assigned count should increment"
+        assert final_driver.last_busy_tick == clean_state.tick, "Last busy tick should update"
+        assert final_driver.is_heading_to_dropoff == False, "Should reset heading flag"
+        assert final_driver.current_ride_id is None, "Should clear current ride"
+        assert final_driver.status == DriverStatus.available, "Should return to available"
+        assert final_driver.id in clean_state.available_drivers, "Should be dispatchable again"
\ No newline at end of file